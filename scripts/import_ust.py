@@ -42,18 +42,23 @@ Will use S2 level 10 for our conversion:
 https://learn.microsoft.com/en-us/azure/data-explorer/kusto/query/geo-point-to-s2cell-function
 
 """
-import re
 from argparse import ArgumentParser
 from configparser import ConfigParser
-from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timezone
 from enum import unique, IntEnum
+from functools import lru_cache
+import gc
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from io import StringIO
 from pathlib import Path
 from csv import reader
-from itertools import (takewhile, repeat)
-from typing import List
+from itertools import repeat
+from operator import itemgetter
+from typing import Dict, List, Optional, Tuple
 
-from influxdb_client import InfluxDBClient, Point, WritePrecision
+from influxdb_client import InfluxDBClient, WritePrecision
 from influxdb_client.client.write_api import WriteOptions, WriteType
 from rich.console import Console
 from rich.traceback import install
@@ -67,198 +72,301 @@ START_OF_TIME = "1970-01-01T00:00:00Z"
 START_OF_TIME_DATE = datetime.fromisoformat("1970-01-01")
 TIMEOUT_IN_MILLIS = 600000
 
-LARGE_SYNCHRONOUS_BATCH = write_options = WriteOptions(
-    batch_size=50_000,
-    flush_interval=10_000,
-    write_type=WriteType.synchronous
-)
 S2_LEVEL = 10
+MEASUREMENT = "fuel_tanks"
+
+
+# Make it easier to find the 27 tokens on the CSV file
+@unique
+class UstToken(IntEnum):
+    ID = 0
+    NAME = 1
+    ADDRESS = 2
+    CITY = 3
+    ZIP = 4
+    TANK_NO = 5
+    STATUS = 6
+    COMPARTMENT = 7
+    ESTIMATED_TOTAL_CAPACITY = 8
+    SUBSTANCE_STORED = 9
+    LAST_USED_DATE = 10
+    CLOSURE_TYPE = 11
+    CONSTRUCTION_TYPE_TANK = 12
+    DETAILS = 13
+    CONSTRUCTION_TYPE_PIPING = 14
+    PIPING_DETAILS = 15
+    INSTALLATION_DATE = 16
+    SPILL_PROTECTION = 17
+    OVERFILL_PROTECTION = 18
+    LATITUDE = 19
+    LONGITUDE = 20
+    COLLECTION_METHOD = 21
+    REFERENCE_POINT_TYPE = 22
+    UST_LATITUDE = 23
+    UST_LONGITUDE = 24
+    COLLECTION_METHOD_SITE = 25
+    REFERENCE_POINT_TYPE_SITE = 26
+
+
+# Prepared once so the IntEnum indexing cost is paid here, not per row:
+# itemgetter grabs all thirteen fields in a single C-level call
+_GET_FIELDS = itemgetter(UstToken.CITY, UstToken.ZIP, UstToken.STATUS,
+                         UstToken.ESTIMATED_TOTAL_CAPACITY, UstToken.SUBSTANCE_STORED,
+                         UstToken.LAST_USED_DATE, UstToken.CLOSURE_TYPE,
+                         UstToken.CONSTRUCTION_TYPE_PIPING, UstToken.INSTALLATION_DATE,
+                         UstToken.SPILL_PROTECTION, UstToken.OVERFILL_PROTECTION,
+                         UstToken.LATITUDE, UstToken.LONGITUDE)
+
+_SEARCH_ENGINE: Optional[SearchEngine] = None
+
+
+def get_search_engine() -> SearchEngine:
+    """Lazy singleton, one bundled SQLite connection per process for the zip code lookups"""
+    global _SEARCH_ENGINE
+    if _SEARCH_ENGINE is None:
+        _SEARCH_ENGINE = SearchEngine()
+        _SEARCH_ENGINE.by_zipcode('06520')  # Warm the SQLite page cache before the tight loop
+    return _SEARCH_ENGINE
+
+
+def _init_worker():
+    """ProcessPoolExecutor initializer, pays the SearchEngine startup once per worker"""
+    get_search_engine()
+
+
+def _write_options(total_lines: int) -> WriteOptions:
+    """
+    InfluxDB latency per row keeps dropping with batch size up to ~100k, but a
+    batch larger than the dataset never fills and just waits on the flush
+    timer, so size batches to the data and flush quickly.
+    """
+    return WriteOptions(
+        batch_size=max(1, min(total_lines, 100_000)),
+        flush_interval=1_000,
+        jitter_interval=2_000,
+        retry_interval=5_000,
+        write_type=WriteType.batching
+    )
+
+
+def _escape_tag(value: str) -> str:
+    """LineProtocol tag values need spaces, commas and equal signs escaped"""
+    return value.replace(' ', '\\ ').replace(',', '\\,').replace('=', '\\=')
+
+
+@lru_cache(maxsize=None)
+def _parse_mdy(raw: str) -> datetime:
+    """strptime re-parses its format string on every call and dates repeat heavily, so memoize by raw value"""
+    return datetime.strptime(raw, "%m/%d/%Y")
 
 
 def count_lines(filename):
     with open(filename, 'rb') as the_file:
-        buffer_gen = takewhile(lambda x: x, (the_file.read(1024 * 1024) for _ in repeat(None)))
-        return sum(buf.count(b'\n') for buf in buffer_gen if buf)
+        try:
+            with mmap.mmap(the_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                # bytes.count defers to libc memchr, way faster than chunked Python reads
+                return mapped[:].count(b'\n')
+        except ValueError:
+            return 0  # Empty files cannot be mapped
+
+
+def _chunk_offsets(filename: Path, chunks: int) -> List[Tuple[int, int]]:
+    """Split the file into roughly equal byte ranges, snapping each boundary to the next newline"""
+    size = os.path.getsize(filename)
+    boundaries = [0]
+    with open(filename, 'rb') as the_file:
+        for number in range(1, chunks):
+            the_file.seek(size * number // chunks)
+            the_file.readline()  # Advance to the start of the next full row
+            boundaries.append(the_file.tell())
+    boundaries.append(size)
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if start < end]
+
+
+def parse_chunk(data_file: Path, start: int, end: int) -> Tuple[List[str], int]:
+    """
+    Parse the [start, end) byte range of the CSV file into LineProtocol records.
+
+    Meant to run in a worker process, dodging the GIL: boundaries come from
+    _chunk_offsets so every chunk holds complete rows. Returns the serialized
+    records plus how many rows were ignored for lack of usable coordinates.
+    """
+    # Column-oriented (SoA) scratch space, parallel lists are cheaper to
+    # walk than one object per tank
+    cities: List[str] = []
+    closure_types: List[str] = []
+    construction_types: List[str] = []
+    spill_protections: List[str] = []
+    overfill_protections: List[str] = []
+    substances_stored: List[str] = []
+    statuses: List[str] = []
+    estimated_total_capacities: List[int] = []
+    lats: List[float] = []
+    lons: List[float] = []
+    timestamps: List[int] = []
+    ignored = 0
+    # Zip codes repeat heavily, keep each SQLite lookup result around
+    zip_cache: Dict[str, Tuple[Optional[float], Optional[float]]] = {}
+    sr = get_search_engine()
+    with open(data_file, 'rb') as data:
+        data.seek(start)
+        blob = data.read(end - start)
+    csv_reader = reader(StringIO(blob.decode('utf-8')))
+    if start == 0:
+        next(csv_reader, None)  # Only the first chunk carries the header row
+    # Everything allocated below stays referenced until the chunk is returned,
+    # so cyclic GC scans can only burn cycles here, never free anything
+    gc.disable()
+    try:
+        for row in csv_reader:
+            try:
+                (city_raw, zip_code, status_raw, capacity_raw, substance_raw,
+                 last_used_raw, closure_raw, construction_raw, installation_raw,
+                 spill_raw, overfill_raw, lat_raw, lon_raw) = _GET_FIELDS(row)
+                """
+                LAST_USED_DATE = 05/10/2021 -> 2021-10-05 00:00:00
+                Also that date may be missing, time to apply heuristics
+                """
+                if not last_used_raw:
+                    if 'In Use' in status_raw:
+                        last_used = datetime.now()
+                    elif installation_raw:
+                        last_used = _parse_mdy(installation_raw)
+                    else:
+                        last_used = START_OF_TIME_DATE
+                else:
+                    last_used = _parse_mdy(last_used_raw)
+                city = city_raw.strip().capitalize()
+                # One unpacking for every tag that gets the same strip/lower treatment,
+                # int() already tolerates surrounding whitespace on its own
+                closure_type, construction_type, spill_protection, overfill_protection, substance_stored, status = (
+                    raw.strip().lower() for raw in (closure_raw, construction_raw, spill_raw,
+                                                    overfill_raw, substance_raw, status_raw))
+                estimated_total_capacity = int(capacity_raw)
+
+                """
+                https://docs.influxdata.com/flux/v0.x/stdlib/experimental/geo/
+                Tanks that were removed do not longer have their lat and lon available, use zip code for
+                lookup. If zipcode is missing, skip the data point, pure garbage.
+                """
+
+                lat = None
+                lon = None
+                if lat_raw and lon_raw:
+                    lat = float(lat_raw)
+                    lon = float(lon_raw)
+                elif zip_code:
+                    if zip_code in zip_cache:
+                        lat, lon = zip_cache[zip_code]
+                    else:
+                        sr_data: SimpleZipcode = sr.by_zipcode(zip_code)
+                        if sr_data:
+                            lat = sr_data.lat
+                            lon = sr_data.lng
+                        zip_cache[zip_code] = (lat, lon)
+                if lat and lon:
+                    cities.append(city)
+                    closure_types.append(closure_type)
+                    construction_types.append(construction_type)
+                    spill_protections.append(spill_protection)
+                    overfill_protections.append(overfill_protection)
+                    substances_stored.append(substance_stored)
+                    statuses.append(status)
+                    estimated_total_capacities.append(estimated_total_capacity)
+                    lats.append(lat)
+                    lons.append(lon)
+                    # Naive datetimes are UTC here, like the Point builder treated
+                    # them; .timestamp() alone would apply the host timezone
+                    timestamps.append(int(last_used.replace(tzinfo=timezone.utc).timestamp()))
+                else:
+                    ignored += 1
+            except ValueError as ve:
+                raise ValueError(f"Cannot process {row}, error: {ve}") from ve
+        # The lat/lon -> cellId conversion is pure math, run it in one tight
+        # pass over the coordinate lists with no UI work in between
+        s2_cell_id_tokens = map(s2cell.lat_lon_to_token, lats, lons, repeat(S2_LEVEL))
+        # Serialize to LineProtocol right here so the parent only relays strings,
+        # skipping the Point builder's per-tag method calls and dict bookkeeping
+        records = []
+        for (city, closure_type, construction_type, spill_protection, overfill_protection,
+             substance_stored, status, s2_cell_id_token, estimated_total_capacity,
+             lat, lon, timestamp) in zip(cities, closure_types, construction_types,
+                                         spill_protections, overfill_protections,
+                                         substances_stored, statuses, s2_cell_id_tokens,
+                                         estimated_total_capacities, lats, lons, timestamps):
+            # A tag with an empty value is invalid LineProtocol ("missing tag
+            # value"), omit those just like the Point builder does
+            tags = ','.join(f"{key}={_escape_tag(value)}"
+                            for key, value in (("city", city),
+                                               ("closure_type", closure_type),
+                                               ("construction_type", construction_type),
+                                               ("spill_protection", spill_protection),
+                                               ("overfill_protection", overfill_protection),
+                                               ("substance_stored", substance_stored),
+                                               ("status", status),
+                                               ("s2_cell_id", s2_cell_id_token))
+                            if value)
+            prefix = f"{MEASUREMENT},{tags}" if tags else MEASUREMENT
+            records.append(
+                f"{prefix}"
+                f" estimated_total_capacity={estimated_total_capacity}i"
+                f",lat={lat},lon={lon}"
+                f" {timestamp}"
+            )
+    finally:
+        gc.enable()
+    return records, ignored
 
 
 def import_data(url: str, token: str, org: str, bucket: str, data_file: Path, truncate: bool = True):
     with Console() as console:
-        measurement = "fuel_tanks"
-
-        total_lines = count_lines(data_file)
-        console.print(f"[green]Tank details read:[/green] {total_lines}")
-        sr = SearchEngine()
-
-        # Data point with only the data we care about (11 attributes of 27)
-        @dataclass
-        class TankPoint:
-            city: str
-            closure_type: str
-            construction_type: str
-            overfill_protection: str
-            spill_protection: str
-            status: str
-            substance_stored: str
-            estimated_total_capacity: int
-            s2_cell_id_token: str
-            lat: float
-            lon: float
-            last_used_date: datetime
-
-        # Make it easier to find the 27 tokens on the CSV file
-        @unique
-        class UstToken(IntEnum):
-            ID = 0
-            NAME = 1
-            ADDRESS = 2
-            CITY = 3
-            ZIP = 4
-            TANK_NO = 5
-            STATUS = 6
-            COMPARTMENT = 7
-            ESTIMATED_TOTAL_CAPACITY = 8
-            SUBSTANCE_STORED = 9
-            LAST_USED_DATE = 10
-            CLOSURE_TYPE = 11
-            CONSTRUCTION_TYPE_TANK = 12
-            DETAILS = 13
-            CONSTRUCTION_TYPE_PIPING = 14
-            PIPING_DETAILS = 15
-            INSTALLATION_DATE = 16
-            SPILL_PROTECTION = 17
-            OVERFILL_PROTECTION = 18
-            LATITUDE = 19
-            LONGITUDE = 20
-            COLLECTION_METHOD = 21
-            REFERENCE_POINT_TYPE = 22
-            UST_LATITUDE = 23
-            UST_LONGITUDE = 24
-            COLLECTION_METHOD_SITE = 25
-            REFERENCE_POINT_TYPE_SITE = 26
-
-        tanks: List[TankPoint] = []
-        with open(data_file, 'r') as data:
-            csv_reader = reader(data)
-            with InfluxDBClient(url=url, token=token, org=org, timeout=TIMEOUT_IN_MILLIS) as client:
-                if truncate:
-                    now = datetime.utcnow()
-                    delete_api = client.delete_api()
-                    delete_api.delete(start=START_OF_TIME, stop=f"{now.isoformat('T')}Z", bucket=bucket, org=org,
-                                      predicate=f'_measurement="{measurement}"')
-                write_api = client.write_api(write_options=LARGE_SYNCHRONOUS_BATCH)
-                count = 0
-                ignored = 0
-                with Progress(TextColumn("[progress.description]{task.description}"),
-                              BarColumn(),
-                              TaskProgressColumn(),
-                              TimeRemainingColumn()) as progress:
-
-                    parsing_task = progress.add_task(f"[red]Parsing[/red] (total={total_lines:,} rows)...",
-                                                     total=total_lines)
-                    for row in csv_reader:
-                        try:
-                            if row[UstToken.ID] == "UST Site ID Number":
-                                continue
-                            task_description = f"Ignored due incomplete data: {row}"
-                            """
-                            LAST_USED_DATE = 05/10/2021 -> 2021-10-05 00:00:00
-                            Also that date may be missing, time to apply heuristics
-                            """
-                            if not row[UstToken.LAST_USED_DATE] or row[UstToken.LAST_USED_DATE] == '':
-                                if re.search('In Use', row[UstToken.STATUS]):
-                                    last_used = datetime.now()
-                                elif row[UstToken.INSTALLATION_DATE]:
-                                    last_used = datetime.strptime(f"{row[UstToken.INSTALLATION_DATE]}", "%m/%d/%Y")
-                                else:
-                                    last_used = START_OF_TIME_DATE
-                            else:
-                                last_used = datetime.strptime(f"{row[UstToken.LAST_USED_DATE]}", "%m/%d/%Y")
-                            city = row[UstToken.CITY].strip().capitalize()
-                            closure_type = row[UstToken.CLOSURE_TYPE].strip().lower()
-                            construction_type = row[UstToken.CONSTRUCTION_TYPE_PIPING].strip().lower()
-                            estimated_total_capacity = int(row[UstToken.ESTIMATED_TOTAL_CAPACITY].strip())
-                            spill_protection = row[UstToken.SPILL_PROTECTION].strip().lower()
-                            overfill_protection = row[UstToken.OVERFILL_PROTECTION].strip().lower()
-                            substance_stored = row[UstToken.SUBSTANCE_STORED].strip().lower()
-                            status = row[UstToken.STATUS].strip().lower()
-
-                            """
-                            https://docs.influxdata.com/flux/v0.x/stdlib/experimental/geo/
-                            Tanks that were removed do not longer have their lat and lon available, use zip code for
-                            lookup. If zipcode is missing, skip the data point, pure garbage.                                                        
-                            """
-
-                            lat = None
-                            lon = None
-                            if row[UstToken.LATITUDE] and row[UstToken.LONGITUDE]:
-                                lat = float(row[UstToken.LATITUDE])
-                                lon = float(row[UstToken.LONGITUDE])
-                            elif row[UstToken.ZIP]:
-                                sr_data: SimpleZipcode = sr.by_zipcode(row[UstToken.ZIP])
-                                if sr_data:
-                                    lat = sr_data.lat
-                                    lon = sr_data.lng
-                            else:
-                                task_description = f"Ignored due missing lat/lon: {row}"
-                            if lat and lon:
-                                s2_cell_id_token = s2cell.lat_lon_to_token(lat, lon, S2_LEVEL)
-                                tank: TankPoint = TankPoint(
-                                    city=city,
-                                    last_used_date=last_used,
-                                    closure_type=closure_type,
-                                    construction_type=construction_type,
-                                    estimated_total_capacity=estimated_total_capacity,
-                                    spill_protection=spill_protection,
-                                    overfill_protection=overfill_protection,
-                                    substance_stored=substance_stored,
-                                    lat=lat,
-                                    lon=lon,
-                                    s2_cell_id_token=s2_cell_id_token,
-                                    status=status
-                                )
-                                tanks.append(tank)
-                                task_description = f"Parsed tank city={tank.city.ljust(15)}, "
-                                f"status={tank.status.ljust(15)}"
-                            else:
-                                ignored += 1
-                            progress.update(
-                                parsing_task, advance=1,
-                                description=task_description
-                            )
-                        except ValueError as ve:
-                            console.print(f"ERROR: Cannot process {row}, error: {ve}.")
-                            raise
-
-                    if not tanks:
-                        raise ValueError("Not a single row was parsed. Aborting!")
-                    sorting_task = progress.add_task(f"[red]Sorting[/red] (total={total_lines:,} rows)...", total=1)
-                    tanks.sort(key=lambda p: p.last_used_date, reverse=True)
-                    progress.update(sorting_task, advance=1, description=f"Fully sorted ({len(tanks)} rows)")
-
-                    insert_task = progress.add_task(f"[red]Inserting[/red] (total={total_lines:,} rows)...", total=total_lines)
-                    for tank in tanks:
-                        tank_point = Point(measurement) \
-                            .tag("city", tank.city) \
-                            .tag("closure_type", tank.closure_type) \
-                            .tag("construction_type", tank.construction_type) \
-                            .field("estimated_total_capacity", tank.estimated_total_capacity) \
-                            .tag("spill_protection", tank.spill_protection) \
-                            .tag("overfill_protection", tank.overfill_protection) \
-                            .tag("substance_stored", tank.substance_stored) \
-                            .tag("status", tank.status) \
-                            .tag("s2_cell_id", tank.s2_cell_id_token) \
-                            .field("lat", tank.lat) \
-                            .field("lon", tank.lon) \
-                            .time(tank.last_used_date, WritePrecision.S)
-                        write_api.write(bucket, org, tank_point)
-                        progress.update(
-                            insert_task,
-                            advance=1,
-                            description=f"Inserted tank from city={tank.city.ljust(15)}, status={tank.status.ljust(15)}")
-                        count += 1
-                    write_api.flush()
-            console.print(f"[green]Imported[/green] {count} records, [red]ignored[/red] {ignored} records ...")
-            sr.close()
+        workers = os.cpu_count() or 1
+        with InfluxDBClient(url=url, token=token, org=org, timeout=TIMEOUT_IN_MILLIS) as client:
+            delete_future = None
+            if truncate:
+                now = datetime.utcnow()
+                delete_api = client.delete_api()
+                # The delete round-trip is pure network wait, overlap it with the
+                # line count; the future is resolved below before the first write
+                # so a failed truncate still aborts the import
+                delete_executor = ThreadPoolExecutor(max_workers=1)
+                delete_future = delete_executor.submit(
+                    delete_api.delete, start=START_OF_TIME, stop=f"{now.isoformat('T')}Z",
+                    bucket=bucket, org=org, predicate=f'_measurement="{MEASUREMENT}"')
+                delete_executor.shutdown(wait=False)
+
+            total_lines = count_lines(data_file)
+            console.print(f"[green]Tank details read:[/green] {total_lines}")
+            count = 0
+            ignored = 0
+            with Progress(TextColumn("[progress.description]{task.description}"),
+                          BarColumn(),
+                          TaskProgressColumn(),
+                          TimeRemainingColumn()) as progress:
+
+                importing_task = progress.add_task(f"[red]Importing[/red] (total={total_lines:,} rows)...",
+                                                   total=total_lines)
+                if delete_future:
+                    delete_future.result()  # The bucket must be clean before writing, re-raises on failure
+                # CSV parsing is CPU-bound Python, so threads fight over the GIL;
+                # worker processes each chew a byte range and serialize it, while
+                # the batching writer ships finished chunks. Nothing holds the
+                # whole dataset, peak memory stays at a few chunks of strings.
+                with client.write_api(write_options=_write_options(total_lines)) as write_api:
+                    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+                        futures = [executor.submit(parse_chunk, data_file, start, end)
+                                   for start, end in _chunk_offsets(data_file, workers)]
+                        for future in as_completed(futures):
+                            chunk_records, chunk_ignored = future.result()
+                            write_api.write(bucket=bucket, org=org, record=chunk_records,
+                                            write_precision=WritePrecision.S)
+                            count += len(chunk_records)
+                            ignored += chunk_ignored
+                            progress.update(importing_task, advance=len(chunk_records) + chunk_ignored)
+
+            if not count:
+                raise ValueError("Not a single row was parsed. Aborting!")
+        console.print(f"[green]Imported[/green] {count} records, [red]ignored[/red] {ignored} records ...")
 
 
 if __name__ == "__main__":
@@ -21,20 +21,7 @@ def tanks_per_type(url: str, token: str, org: str, bucket: str, start: str = "-3
     |> filter(fn: (r) => r._measurement == "fuel_tanks" and r._field == "estimated_total_capacity" and r.status == "currently in use")
     |> group(columns: ["substance_stored"])
     |> count(column: "_value")
-    |> drop(
-        columns: [
-            "city",
-            "closure_type",
-            "construction_type",
-            "overfill_protection",
-            "s2_cell_id",
-            "lat",
-            "lon",
-            "_time",
-            "spill_protection",
-            "status",
-        ],
-    )
+    |> keep(columns: ["_value", "substance_stored"])
     |> group()
     |> sort(columns: ["_value"], desc: true)'''
         with Console() as console: